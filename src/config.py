@@ -1,20 +1,23 @@
 """Configuration module for RAG QA System."""
 
 import os
-from typing import Optional
-from pydantic import BaseModel, field_validator
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Tuple
 
 
-class Settings(BaseModel):
+@dataclass(frozen=True)
+class Settings:
     """Application settings."""
     
     # OpenAI Configuration
-    openai_api_key: str
-    openai_model: str = "gpt-4"
-    embedding_model: str = "text-embedding-ada-002"
+    openai_api_key: str = ""
+    openai_model: str = "gpt-4o-mini"
+    embedding_model: str = "text-embedding-3-small"
+    embedding_dim: int = 1024
     
     # Pinecone Configuration
-    pinecone_api_key: str
+    pinecone_api_key: str = ""
     pinecone_environment: str = "us-east1-gcp"
     pinecone_index_name: str = "qa-documents"
     
@@ -29,26 +32,7 @@ class Settings(BaseModel):
     # Database Settings
     database_url: str = "sqlite:///qa_system.db"
     
-    def __init__(self, **kwargs):
-        # Load from environment variables
-        env_vars = {
-            'openai_api_key': os.getenv('OPENAI_API_KEY', ''),
-            'openai_model': os.getenv('OPENAI_MODEL', 'gpt-4'),
-            'embedding_model': os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002'),
-            'pinecone_api_key': os.getenv('PINECONE_API_KEY', ''),
-            'pinecone_environment': os.getenv('PINECONE_ENVIRONMENT', 'us-east1-gcp'),
-            'pinecone_index_name': os.getenv('PINECONE_INDEX_NAME', 'qa-documents'),
-            'max_file_size_mb': int(os.getenv('MAX_FILE_SIZE_MB', '50')),
-            'max_files_count': int(os.getenv('MAX_FILES_COUNT', '100')),
-            'chunk_size': int(os.getenv('CHUNK_SIZE', '1024')),
-            'chunk_overlap': int(os.getenv('CHUNK_OVERLAP', '20')),
-            'similarity_top_k': int(os.getenv('SIMILARITY_TOP_K', '5')),
-            'similarity_threshold': float(os.getenv('SIMILARITY_THRESHOLD', '0.7')),
-            'database_url': os.getenv('DATABASE_URL', 'sqlite:///qa_system.db')
-        }
-        env_vars.update(kwargs)
-        super().__init__(**env_vars)
-        
+    def __post_init__(self):
         # Validate required keys
         if not self.openai_api_key or self.openai_api_key == "your_openai_api_key_here":
             raise ValueError("OPENAI_API_KEY must be set")
@@ -56,6 +40,36 @@ class Settings(BaseModel):
             raise ValueError("PINECONE_API_KEY must be set")
 
 
+# Settings field -> (environment variable, type). Defaults live only on the
+# dataclass; unset variables are skipped instead of being cast.
+_ENV_VARS: Dict[str, Tuple[str, Callable[[str], Any]]] = {
+    'openai_api_key': ('OPENAI_API_KEY', str),
+    'openai_model': ('OPENAI_MODEL', str),
+    'embedding_model': ('EMBEDDING_MODEL', str),
+    'embedding_dim': ('EMBEDDING_DIM', int),
+    'pinecone_api_key': ('PINECONE_API_KEY', str),
+    'pinecone_environment': ('PINECONE_ENVIRONMENT', str),
+    'pinecone_index_name': ('PINECONE_INDEX_NAME', str),
+    'max_file_size_mb': ('MAX_FILE_SIZE_MB', int),
+    'max_files_count': ('MAX_FILES_COUNT', int),
+    'chunk_size': ('CHUNK_SIZE', int),
+    'chunk_overlap': ('CHUNK_OVERLAP', int),
+    'similarity_top_k': ('SIMILARITY_TOP_K', int),
+    'similarity_threshold': ('SIMILARITY_THRESHOLD', float),
+    'database_url': ('DATABASE_URL', str),
+}
+
+
+def _read_env() -> Dict[str, Any]:
+    """Collect settings overrides from the environment variables that are set."""
+    return {
+        field: cast(os.environ[name])
+        for field, (name, cast) in _ENV_VARS.items()
+        if name in os.environ
+    }
+
+
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Get application settings."""
     try:
@@ -63,4 +77,4 @@ def get_settings() -> Settings:
         load_dotenv()
     except ImportError:
         pass
-    return Settings()
\ No newline at end of file
+    return Settings(**_read_env())
@@ -2,27 +2,213 @@
 
 import os
 import logging
-from typing import List, Dict, Any, Optional
-from io import BytesIO
-import PyPDF2
-from llama_index.core import SimpleDirectoryReader, Document
-from llama_index.core.node_parser import SentenceSplitter
-from langdetect import detect
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple, Union
 import streamlit as st
 
+# PDF, language and LlamaIndex imports are deferred to the functions that use
+# them: they are slow to import and worker processes only need a subset
+if TYPE_CHECKING:
+    import pymupdf
+    from llama_index.core import Document
+
 logger = logging.getLogger(__name__)
 
+# Per-page parallelism only pays off once a document is large enough to
+# amortize the worker start-up cost
+PARALLEL_PAGES_THRESHOLD = 50
+PAGE_BATCH_SIZE = 10
+PAGE_WORKERS = 4
+
+# fast-langdetect warns about every input longer than this, and a sentence or
+# two is all the fastText model needs
+LANGDETECT_SAMPLE_CHARS = 100
+
+
+def _open_pdf(source: Union[str, bytes]) -> "pymupdf.Document":
+    """Open a PDF from a file path or from raw bytes."""
+    import pymupdf
+    
+    if isinstance(source, (bytes, bytearray)):
+        return pymupdf.open(stream=source, filetype="pdf")
+    # MuPDF reads the file itself, so pages are loaded on demand without
+    # copying the whole payload into a Python buffer first
+    return pymupdf.open(source, filetype="pdf")
+
+
+def _extract_pages(doc: "pymupdf.Document") -> List[str]:
+    """Extract the text of every page into a preallocated list."""
+    parts = [""] * doc.page_count
+    for i, page in enumerate(doc):
+        parts[i] = page.get_text() or ""
+    return parts
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) in a worker process."""
+    with _open_pdf(pdf_path) as doc:
+        return [doc[i].get_text() or "" for i in range(start, stop)]
+
+
+def _extract_pages_parallel(
+    pdf_path: str,
+    page_count: int,
+    batch_size: int = PAGE_BATCH_SIZE,
+    max_workers: int = PAGE_WORKERS
+) -> List[str]:
+    """Extract page text in batches across worker processes.
+    
+    MuPDF is not thread-safe, so each worker reopens the document itself.
+    """
+    parts = [""] * page_count
+    max_workers = min(max_workers, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _extract_page_range, pdf_path, start, min(start + batch_size, page_count)
+            ): start
+            for start in range(0, page_count, batch_size)
+        }
+        for future in as_completed(futures):
+            start = futures[future]
+            pages = future.result()
+            parts[start:start + len(pages)] = pages
+    return parts
+
+
+def _read_pdf_metadata(doc: Optional["pymupdf.Document"], filename: str) -> Dict[str, Any]:
+    """Read metadata from an opened PDF document, falling back to defaults."""
+    metadata = {
+        "title": filename,
+        "author": "Unknown",
+        "creation_date": None,
+        "filename": filename
+    }
+    
+    try:
+        if doc is not None and doc.metadata:
+            metadata.update({
+                "title": doc.metadata.get("title") or filename,
+                "author": doc.metadata.get("author") or "Unknown",
+                "creation_date": doc.metadata.get("creationDate") or None
+            })
+    except Exception as e:
+        logger.warning(f"Could not extract metadata from {filename}: {e}")
+    
+    return metadata
+
+
+def _parse_pdf(
+    source: Union[str, bytes],
+    filename: str,
+    parallel_pages: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """Open a PDF once and return its text together with its metadata.
+    
+    With ``parallel_pages`` set, large documents on disk are split into page
+    batches extracted by worker processes.
+    """
+    try:
+        with _open_pdf(source) as doc:
+            metadata = _read_pdf_metadata(doc, filename)
+            if (
+                parallel_pages
+                and isinstance(source, str)
+                and doc.page_count >= PARALLEL_PAGES_THRESHOLD
+            ):
+                pages = _extract_pages_parallel(source, doc.page_count)
+            else:
+                pages = _extract_pages(doc)
+            text = "\n".join(pages)
+        return text.strip(), metadata
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF: {e}")
+        raise
+
+
+def _extract_pdf_metadata(pdf_content: bytes, filename: str) -> Dict[str, Any]:
+    """Extract metadata from PDF content."""
+    try:
+        with _open_pdf(pdf_content) as doc:
+            return _read_pdf_metadata(doc, filename)
+    except Exception as e:
+        logger.warning(f"Could not extract metadata from {filename}: {e}")
+        return _read_pdf_metadata(None, filename)
+
+
+def _extract_text_from_pdf(pdf_content: bytes) -> str:
+    """Extract text from PDF content."""
+    return _parse_pdf(pdf_content, "")[0]
+
+
+def _detect_language(text: str) -> str:
+    """Detect language of the text."""
+    from fast_langdetect import detect
+    
+    try:
+        # Collapse whitespace so PDF line breaks and layout padding don't eat
+        # the sample; the fastText model rejects newlines
+        sample = " ".join(text[:1000].split())[:LANGDETECT_SAMPLE_CHARS]
+        return detect(sample)["lang"]
+    except:
+        return "en"  # Default to English
+
+
+def _process_one(
+    pdf_path: str,
+    filename: str,
+    parallel_pages: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """Extract text and metadata from a single PDF on disk.
+    
+    Kept at module level so it can be pickled and run in a worker process.
+    """
+    text, metadata = _parse_pdf(pdf_path, filename, parallel_pages=parallel_pages)
+    if text.strip():
+        metadata["language"] = _detect_language(text)
+    return text, metadata
+
 
 class DocumentProcessor:
     """Handle PDF document processing and text extraction."""
     
-    def __init__(self, max_file_size_mb: int = 50, max_files_count: int = 100):
+    def __init__(
+        self,
+        max_file_size_mb: int = 50,
+        max_files_count: int = 100,
+        use_fast_chunker: bool = True,
+        child_chunk_size: Optional[int] = 256
+    ):
         self.max_file_size_mb = max_file_size_mb
         self.max_files_count = max_files_count
+        from llama_index.core.node_parser import SentenceSplitter
+        
         self.node_parser = SentenceSplitter(
             chunk_size=1024,
             chunk_overlap=20
         )
+        # Byte-size chunking in native code; the token-based SentenceSplitter
+        # above stays as the fallback when chonkie isn't installed or exact
+        # token budgets are required
+        self.fast_chunker = None
+        if use_fast_chunker:
+            try:
+                from chonkie import FastChunker
+                self.fast_chunker = FastChunker(chunk_size=4096, delimiters="\n.?!")
+            except ImportError:
+                logger.warning(
+                    "chonkie FastChunker unavailable (needs chonkie>=1.5.2); "
+                    "falling back to SentenceSplitter"
+                )
+        # Small child chunks are embedded for precise retrieval while their
+        # parent chunk is what gets handed to the LLM; None keeps flat chunks
+        self.child_parser = None
+        if child_chunk_size:
+            self.child_parser = SentenceSplitter(
+                chunk_size=child_chunk_size,
+                chunk_overlap=20
+            )
     
     def validate_files(self, uploaded_files: List[Any]) -> bool:
         """Validate uploaded files against size and count limits."""
@@ -40,90 +226,133 @@ class DocumentProcessor:
     
     def extract_pdf_metadata(self, pdf_content: bytes, filename: str) -> Dict[str, Any]:
         """Extract metadata from PDF content."""
-        metadata = {
-            "title": filename,
-            "author": "Unknown",
-            "creation_date": None,
-            "filename": filename
-        }
-        
-        try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_content))
-            if pdf_reader.metadata:
-                metadata.update({
-                    "title": pdf_reader.metadata.get("/Title", filename),
-                    "author": pdf_reader.metadata.get("/Author", "Unknown"),
-                    "creation_date": pdf_reader.metadata.get("/CreationDate", None)
-                })
-        except Exception as e:
-            logger.warning(f"Could not extract metadata from {filename}: {e}")
-        
-        return metadata
+        return _extract_pdf_metadata(pdf_content, filename)
     
     def extract_text_from_pdf(self, pdf_content: bytes) -> str:
         """Extract text from PDF content."""
-        try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_content))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\\n"
-            return text.strip()
-        except Exception as e:
-            logger.error(f"Error extracting text from PDF: {e}")
-            raise
+        return _extract_text_from_pdf(pdf_content)
     
     def detect_language(self, text: str) -> str:
         """Detect language of the text."""
-        try:
-            return detect(text[:1000])  # Use first 1000 chars for detection
-        except:
-            return "en"  # Default to English
+        return _detect_language(text)
     
-    def process_uploaded_files(self, uploaded_files: List[Any]) -> List[Document]:
+    def process_uploaded_files(self, uploaded_files: List[Any]) -> List["Document"]:
         """Process uploaded files and return LlamaIndex documents."""
         if not self.validate_files(uploaded_files):
             return []
         
-        documents = []
+        results: List[Optional[Tuple[str, Dict[str, Any]]]] = [None] * len(uploaded_files)
         progress_bar = st.progress(0)
         
-        for i, uploaded_file in enumerate(uploaded_files):
-            try:
-                # Read file content
-                pdf_content = uploaded_file.read()
-                
-                # Extract text
-                text = self.extract_text_from_pdf(pdf_content)
-                if not text.strip():
-                    st.warning(f"Не удалось извлечь текст из {uploaded_file.name}")
-                    continue
-                
-                # Extract metadata
-                metadata = self.extract_pdf_metadata(pdf_content, uploaded_file.name)
-                metadata["language"] = self.detect_language(text)
-                metadata["file_size"] = uploaded_file.size
-                
-                # Create LlamaIndex document
-                document = Document(
-                    text=text,
-                    metadata=metadata
-                )
-                documents.append(document)
-                
-                # Update progress
-                progress_bar.progress((i + 1) / len(uploaded_files))
-                
-            except Exception as e:
-                st.error(f"Ошибка обработки файла {uploaded_file.name}: {e}")
-                logger.error(f"Error processing {uploaded_file.name}: {e}")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Spool uploads to disk straight from Streamlit's buffer; workers get a
+            # path instead of a pickled copy of the payload
+            payloads = []
+            for i, uploaded_file in enumerate(uploaded_files):
+                pdf_path = os.path.join(tmp_dir, f"{i}.pdf")
+                with open(pdf_path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                payloads.append((uploaded_file.name, pdf_path))
+            
+            if len(payloads) == 1:
+                name, pdf_path = payloads[0]
+                try:
+                    # A lone upload has the cores to itself, so split it by pages
+                    results[0] = _process_one(pdf_path, name, parallel_pages=True)
+                except Exception as e:
+                    st.error(f"Ошибка обработки файла {name}: {e}")
+                    logger.error(f"Error processing {name}: {e}")
+                progress_bar.progress(1.0)
+            else:
+                max_workers = min(os.cpu_count() or 1, len(payloads))
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(_process_one, pdf_path, name): i
+                        for i, (name, pdf_path) in enumerate(payloads)
+                    }
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        i = futures[future]
+                        name = payloads[i][0]
+                        try:
+                            results[i] = future.result()
+                        except Exception as e:
+                            st.error(f"Ошибка обработки файла {name}: {e}")
+                            logger.error(f"Error processing {name}: {e}")
+                        progress_bar.progress(done / len(payloads))
+        
+        from llama_index.core import Document
+        
+        documents = []
+        for uploaded_file, result in zip(uploaded_files, results):
+            if result is None:
+                continue
+            
+            text, metadata = result
+            if not text.strip():
+                st.warning(f"Не удалось извлечь текст из {uploaded_file.name}")
+                continue
+            
+            metadata["file_size"] = uploaded_file.size
+            
+            # Create LlamaIndex document
+            documents.append(Document(
+                text=text,
+                metadata=metadata
+            ))
         
         progress_bar.empty()
         return documents
     
-    def chunk_documents(self, documents: List[Document]) -> List[Any]:
-        """Split documents into chunks using LlamaIndex node parser."""
+    def _split_parents(self, documents: List["Document"]) -> List[Any]:
+        """Split documents into top-level chunks."""
+        from llama_index.core.schema import TextNode, NodeRelationship
+        
+        if self.fast_chunker is None:
+            return self.node_parser.get_nodes_from_documents(documents)
+        
         nodes = []
         for document in documents:
-            doc_nodes = self.node_parser.get_nodes_from_documents([document])
-            nodes.extend(doc_nodes)
-        return nodes
\ No newline at end of file
+            for chunk in self.fast_chunker.chunk(document.text):
+                nodes.append(TextNode(
+                    text=chunk.text,
+                    metadata=dict(document.metadata),
+                    start_char_idx=chunk.start_index,
+                    end_char_idx=chunk.end_index,
+                    relationships={NodeRelationship.SOURCE: document.as_related_node_info()}
+                ))
+        return nodes
+    
+    def chunk_documents(self, documents: List["Document"]) -> List[Any]:
+        """Split documents into chunks for embedding.
+        
+        In hierarchical mode only the child chunks are returned; each carries
+        its parent's id and text in metadata so retrieval can expand it.
+        """
+        from llama_index.core.schema import NodeRelationship
+        
+        parents = self._split_parents(documents)
+        if self.child_parser is None:
+            return parents
+        
+        # Split one parent at a time: the splitter rewrites each child's SOURCE
+        # to the parent's own source, so the parent can't be recovered from it
+        children = []
+        for parent in parents:
+            for child in self.child_parser.get_nodes_from_documents([parent]):
+                child.metadata["parent_id"] = parent.node_id
+                child.metadata["parent_text"] = parent.text
+                # Rebind rather than extend: the splitter shares these lists with the parent
+                child.excluded_embed_metadata_keys = [
+                    *child.excluded_embed_metadata_keys, "parent_id", "parent_text"
+                ]
+                child.excluded_llm_metadata_keys = [
+                    *child.excluded_llm_metadata_keys, "parent_id", "parent_text"
+                ]
+                # Point the child at the original document, not at its parent chunk
+                child.relationships[NodeRelationship.PARENT] = parent.as_related_node_info()
+                if NodeRelationship.SOURCE in parent.relationships:
+                    child.relationships[NodeRelationship.SOURCE] = (
+                        parent.relationships[NodeRelationship.SOURCE]
+                    )
+                children.append(child)
+        return children
@@ -7,7 +7,7 @@ from typing import Optional, Dict, Any
 
 from config import get_settings
 from document_processor import DocumentProcessor
-from vector_store import VectorStoreManager
+from vector_store import VectorStoreManager, VectorStoreOptions
 from query_engine import QueryEngine
 
 # Configure logging
@@ -22,28 +22,65 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def load_settings():
+    """Load application settings once per process."""
+    return get_settings()
+
+@st.cache_resource
+def load_vector_store_manager(
+    api_key: str,
+    environment: str,
+    index_name: str,
+    embedding_model: str,
+    embedding_dim: int,
+    llm_model: str
+) -> VectorStoreManager:
+    """Create the vector store manager once per process and share it across sessions."""
+    return VectorStoreManager(
+        api_key=api_key,
+        environment=environment,
+        index_name=index_name,
+        embedding_model=embedding_model,
+        llm_model=llm_model,
+        options=VectorStoreOptions(embedding_dim=embedding_dim)
+    )
+
+@st.cache_resource
+def load_document_processor(max_file_size_mb: int, max_files_count: int) -> DocumentProcessor:
+    """Create the document processor once per process and share it across sessions."""
+    return DocumentProcessor(
+        max_file_size_mb=max_file_size_mb,
+        max_files_count=max_files_count
+    )
+
 def initialize_session_state():
     """Initialize Streamlit session state."""
     if 'settings' not in st.session_state:
         try:
-            st.session_state.settings = get_settings()
+            st.session_state.settings = load_settings()
         except Exception as e:
             st.error(f"Ошибка конфигурации: {e}")
             st.stop()
     
     if 'vector_store_manager' not in st.session_state:
-        st.session_state.vector_store_manager = VectorStoreManager(
+        st.session_state.vector_store_manager = load_vector_store_manager(
             api_key=st.session_state.settings.pinecone_api_key,
             environment=st.session_state.settings.pinecone_environment,
-            index_name=st.session_state.settings.pinecone_index_name
+            index_name=st.session_state.settings.pinecone_index_name,
+            embedding_model=st.session_state.settings.embedding_model,
+            embedding_dim=st.session_state.settings.embedding_dim,
+            llm_model=st.session_state.settings.openai_model
         )
     
     if 'document_processor' not in st.session_state:
-        st.session_state.document_processor = DocumentProcessor(
+        st.session_state.document_processor = load_document_processor(
             max_file_size_mb=st.session_state.settings.max_file_size_mb,
             max_files_count=st.session_state.settings.max_files_count
         )
     
+    # Query history and statistics are per user, so the query engine stays
+    # in session state rather than in the shared resource cache
     if 'query_engine' not in st.session_state:
         st.session_state.query_engine = QueryEngine(st.session_state.vector_store_manager)
     
@@ -147,12 +184,14 @@ def render_document_upload():
                             st.error("Ошибка создания индекса Pinecone")
                             return
                         
-                        if not st.session_state.vector_store_manager.create_vector_index(documents):
+                        nodes = st.session_state.document_processor.chunk_documents(documents)
+                        if not st.session_state.vector_store_manager.create_vector_index(nodes):
                             st.error("Ошибка создания векторного индекса")
                             return
                     
                     st.session_state.documents_loaded = True
                     st.session_state.index_stats = st.session_state.vector_store_manager.get_index_stats()
+                    st.session_state.query_engine.clear_answer_cache()
                     st.success("Документы успешно проиндексированы!")
                     st.rerun()
                 else:
@@ -1,32 +1,23 @@
 """Query engine for semantic search and answer generation."""
 
+import copy
 import logging
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
-from langdetect import detect
-from llama_index.core.base.response.schema import Response
+import numpy as np
+from fast_langdetect import detect
 
 logger = logging.getLogger(__name__)
 
+ANSWER_CACHE_SIZE = 128
 
-class QueryEngine:
-    """Handle query processing and response generation."""
-    
-    def __init__(self, vector_store_manager):
-        self.vector_store_manager = vector_store_manager
-        self.query_history = []
-    
-    def detect_query_language(self, query: str) -> str:
-        """Detect the language of the query."""
-        try:
-            return detect(query)
-        except:
-            return "en"
-    
-    def get_language_prompt(self, language: str) -> str:
-        """Get system prompt based on detected language."""
-        prompts = {
-            "ru": """Ты помощник для ответов на вопросы на основе предоставленных документов.
+# fast-langdetect warns about inputs longer than this
+LANGDETECT_SAMPLE_CHARS = 100
+
+_LANG_PROMPTS = {
+    "ru": """Ты помощник для ответов на вопросы на основе предоставленных документов.
             
 Инструкции:
 1. Отвечай на русском языке
@@ -34,8 +25,8 @@ class QueryEngine:
 3. Если информации недостаточно, так и скажи
 4. Указывай источники своих ответов
 5. Будь конкретным и точным""",
-            
-            "en": """You are an assistant for answering questions based on provided documents.
+    
+    "en": """You are an assistant for answering questions based on provided documents.
             
 Instructions:
 1. Answer in English
@@ -43,56 +34,170 @@ Instructions:
 3. If information is insufficient, say so
 4. Cite your sources
 5. Be specific and accurate"""
-        }
-        return prompts.get(language, prompts["en"])
+}
+
+
+@lru_cache(maxsize=1024)
+def _detect_query_language(query: str) -> str:
+    """Detect the language of the query, memoized on the raw query string."""
+    try:
+        # Longer inputs only trigger a fast-langdetect warning per call
+        return detect(" ".join(query.split())[:LANGDETECT_SAMPLE_CHARS])["lang"]
+    except:
+        return "en"
+
+
+class QueryEngine:
+    """Handle query processing and response generation."""
+    
+    def __init__(self, vector_store_manager, max_history: int = 200):
+        self.vector_store_manager = vector_store_manager
+        self.query_history = deque(maxlen=max_history)
+        self._answer_cache = OrderedDict()
+        self._answer_cache_generation = self._index_generation()
+        self._reset_statistics()
+    
+    def _reset_statistics(self):
+        """Reset the running counters behind get_statistics."""
+        self._total = 0
+        self._successful = 0
+        self._confidence_sum = 0.0
+        self._lang_counts = Counter()
+        self._recent = deque(maxlen=24)
+    
+    def _record_result(self, result: Dict[str, Any]):
+        """Add a result to history and update the running statistics."""
+        self.query_history.append(result)
+        
+        success = result.get("success", False)
+        self._total += 1
+        self._recent.append(success)
+        if success:
+            self._successful += 1
+            self._confidence_sum += result.get("confidence", 0)
+            self._lang_counts[result.get("language", "unknown")] += 1
+    
+    def _answer_cache_key(
+        self,
+        query: str,
+        similarity_top_k: int,
+        similarity_threshold: float,
+        metadata_filters: Optional[Dict],
+        generation: int = 0
+    ) -> Optional[Tuple]:
+        """Build the answer cache key, or None when the filters aren't hashable.
+        
+        ``generation`` is the index generation the answer was computed
+        against, so an answer finished after the index changed is never served.
+        """
+        try:
+            return (
+                generation,
+                query,
+                similarity_top_k,
+                similarity_threshold,
+                frozenset((metadata_filters or {}).items())
+            )
+        except TypeError:
+            # Mutable filter values (e.g. lists) are never cached
+            return None
+    
+    def _index_generation(self) -> int:
+        return getattr(self.vector_store_manager, "index_generation", 0)
+    
+    def clear_answer_cache(self):
+        """Drop cached answers, e.g. after the index contents change."""
+        self._answer_cache.clear()
+    
+    def detect_query_language(self, query: str) -> str:
+        """Detect the language of the query."""
+        return _detect_query_language(query)
     
-    def calculate_confidence_score(self, response: Response) -> float:
-        """Calculate confidence score based on response quality."""
-        if not response.source_nodes:
+    def get_language_prompt(self, language: str) -> str:
+        """Get system prompt based on detected language."""
+        return _LANG_PROMPTS.get(language, _LANG_PROMPTS["en"])
+    
+    def calculate_confidence_score(
+        self,
+        scores: np.ndarray,
+        response_length: int,
+        source_count: int
+    ) -> float:
+        """Calculate confidence score from prebuilt node scores and response shape."""
+        if not source_count:
             return 0.0
         
-        # Calculate average similarity scores
-        scores = [node.score for node in response.source_nodes if hasattr(node, 'score') and node.score]
-        if not scores:
+        if not scores.size:
             return 0.5  # Default moderate confidence
         
-        avg_score = sum(scores) / len(scores)
+        avg_score = float(scores.mean())
         
         # Convert to 0-100 scale
         confidence = min(100, max(0, avg_score * 100))
         
         # Adjust based on response length and source count
-        if len(response.response) < 50:
+        if response_length < 50:
             confidence *= 0.8  # Reduce confidence for very short responses
         
-        if len(response.source_nodes) >= 3:
+        if source_count >= 3:
             confidence *= 1.1  # Boost confidence for multiple sources
         
         return min(100, confidence)
     
-    def format_sources(self, source_nodes: List[Any]) -> List[Dict[str, Any]]:
-        """Format source nodes for display."""
+    def _summarize_nodes(self, source_nodes: List[Any]) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """Collect similarity scores and display info for source nodes in one pass."""
+        scores = []
         sources = []
         for i, node in enumerate(source_nodes):
-            source_info = {
+            score = getattr(node, 'score', 0.0)
+            if score:
+                scores.append(score)
+            text = node.text
+            metadata = node.metadata
+            sources.append({
                 "index": i + 1,
-                "score": getattr(node, 'score', 0.0),
-                "filename": node.metadata.get("filename", "Unknown"),
-                "title": node.metadata.get("title", "Unknown"),
-                "author": node.metadata.get("author", "Unknown"),
-                "text_snippet": node.text[:200] + "..." if len(node.text) > 200 else node.text
-            }
-            sources.append(source_info)
-        return sources
+                "score": score,
+                "filename": metadata.get("filename", "Unknown"),
+                "title": metadata.get("title", "Unknown"),
+                "author": metadata.get("author", "Unknown"),
+                "text_snippet": text if len(text) <= 200 else text[:200] + "..."
+            })
+        return np.asarray(scores, dtype=np.float64), sources
+    
+    def format_sources(self, source_nodes: List[Any]) -> List[Dict[str, Any]]:
+        """Format source nodes for display."""
+        return self._summarize_nodes(source_nodes)[1]
     
     def process_query(
         self, 
         query: str, 
         similarity_top_k: int = 5,
         similarity_threshold: float = 0.7,
-        metadata_filters: Optional[Dict] = None
+        metadata_filters: Optional[Dict] = None,
+        bypass_cache: bool = False
     ) -> Dict[str, Any]:
-        """Process a query and return structured response."""
+        """Process a query and return structured response.
+        
+        Answers are memoized on the query and search parameters; pass
+        ``bypass_cache=True`` to force a fresh retrieval and generation.
+        """
+        
+        # The manager is shared across sessions, so another session's upload
+        # or delete must invalidate this session's answers too
+        generation = self._index_generation()
+        if generation != self._answer_cache_generation:
+            self._answer_cache.clear()
+            self._answer_cache_generation = generation
+        
+        cache_key = self._answer_cache_key(
+            query, similarity_top_k, similarity_threshold, metadata_filters, generation
+        )
+        if not bypass_cache and cache_key in self._answer_cache:
+            self._answer_cache.move_to_end(cache_key)
+            result = copy.deepcopy(self._answer_cache[cache_key])
+            result["timestamp"] = datetime.now().isoformat()
+            self._record_result(result)
+            return result
         
         # Detect query language
         query_language = self.detect_query_language(query)
@@ -100,7 +205,8 @@ Instructions:
         # Get query engine
         query_engine = self.vector_store_manager.get_query_engine(
             similarity_top_k=similarity_top_k,
-            filters=metadata_filters
+            filters=metadata_filters,
+            similarity_cutoff=similarity_threshold
         )
         
         if not query_engine:
@@ -113,13 +219,8 @@ Instructions:
             # Execute query
             response = query_engine.query(query)
             
-            # Filter by similarity threshold
-            filtered_sources = [
-                node for node in response.source_nodes 
-                if hasattr(node, 'score') and node.score >= similarity_threshold
-            ]
-            
-            if not filtered_sources:
+            # Sources below the similarity threshold were dropped by the retriever
+            if not response.source_nodes:
                 return {
                     "success": True,
                     "answer": "Не найдено релевантных документов для ответа на ваш вопрос." if query_language == "ru" else "No relevant documents found to answer your question.",
@@ -130,14 +231,13 @@ Instructions:
                     "timestamp": datetime.now().isoformat()
                 }
             
-            # Update response with filtered sources
-            response.source_nodes = filtered_sources
+            # Gather scores and formatted sources in a single pass
+            scores, sources = self._summarize_nodes(response.source_nodes)
             
             # Calculate confidence
-            confidence = self.calculate_confidence_score(response)
-            
-            # Format sources
-            sources = self.format_sources(filtered_sources)
+            confidence = self.calculate_confidence_score(
+                scores, len(response.response), len(response.source_nodes)
+            )
             
             # Prepare result
             result = {
@@ -151,7 +251,13 @@ Instructions:
             }
             
             # Add to history
-            self.query_history.append(result)
+            self._record_result(result)
+            
+            if cache_key is not None:
+                self._answer_cache[cache_key] = copy.deepcopy(result)
+                self._answer_cache.move_to_end(cache_key)
+                if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+                    self._answer_cache.popitem(last=False)
             
             return result
             
@@ -164,15 +270,17 @@ Instructions:
     
     def get_query_history(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent query history."""
-        return self.query_history[-limit:] if self.query_history else []
+        return list(self.query_history)[-limit:] if self.query_history else []
     
     def clear_history(self):
         """Clear query history."""
-        self.query_history = []
+        self.query_history.clear()
+        self._answer_cache.clear()
+        self._reset_statistics()
     
     def get_statistics(self) -> Dict[str, Any]:
-        """Get query statistics."""
-        if not self.query_history:
+        """Get query statistics from the running counters."""
+        if not self._total:
             return {
                 "total_queries": 0,
                 "avg_confidence": 0.0,
@@ -180,22 +288,12 @@ Instructions:
                 "recent_queries": 0
             }
         
-        successful_queries = [q for q in self.query_history if q.get("success", False)]
-        
-        # Language distribution
-        languages = [q.get("language", "unknown") for q in successful_queries]
-        lang_dist = {}
-        for lang in languages:
-            lang_dist[lang] = lang_dist.get(lang, 0) + 1
-        
-        # Average confidence
-        confidences = [q.get("confidence", 0) for q in successful_queries]
-        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+        avg_confidence = self._confidence_sum / self._successful if self._successful else 0
         
         return {
-            "total_queries": len(self.query_history),
-            "successful_queries": len(successful_queries),
+            "total_queries": self._total,
+            "successful_queries": self._successful,
             "avg_confidence": round(avg_confidence, 2),
-            "language_distribution": lang_dist,
-            "recent_queries": len([q for q in self.query_history[-24:] if q.get("success", False)])
-        }
\ No newline at end of file
+            "language_distribution": dict(self._lang_counts),
+            "recent_queries": sum(self._recent)
+        }
@@ -0,0 +1,145 @@
+"""Semantic cache of query embeddings and the responses they produced."""
+
+import threading
+from typing import Any, Hashable, List, Optional, Tuple
+import numpy as np
+
+
+def _source_ids(response: Any) -> frozenset:
+    """Ids of the nodes a response was synthesized from."""
+    return frozenset(
+        item.node.node_id for item in (getattr(response, "source_nodes", None) or [])
+    )
+
+
+class SemanticCache:
+    """In-memory LRU of query embeddings and the responses they produced.
+    
+    Each cached question defines a region with its own similarity threshold,
+    starting at ``tau``. A lookup returns a cached response when a previous
+    question asked with the same search parameters is at least as similar to
+    the new one as that region's threshold.
+    
+    Thresholds adapt on misses: when a new question lands near a region, the
+    sources it actually retrieved are compared with the region's cached ones.
+    The threshold is only lowered towards that similarity when the sources
+    match exactly and the region's recall (an exponential moving average of
+    the overlap) stays high; otherwise it moves back up. It never drops below
+    ``min_tau``, which stays close to ``tau``: questions that differ only in
+    an entity or a year are often this similar and share sources, yet need
+    different answers.
+    
+    A ``capacity`` of 0 disables the cache. The cache is shared by every
+    session using the manager, so all access goes through one lock.
+    """
+    
+    def __init__(
+        self,
+        capacity: int = 256,
+        tau: float = 0.95,
+        min_tau: float = 0.93,
+        recall_target: float = 0.8,
+        alpha: float = 0.2
+    ):
+        self.capacity = capacity
+        self.tau = tau
+        self.min_tau = min(min_tau, tau)
+        self.recall_target = recall_target
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.clear()
+    
+    def clear(self):
+        """Drop all cached entries."""
+        with self._lock:
+            self._embeddings: Optional[np.ndarray] = None  # (capacity, dim), unit rows
+            self._keys: List[Hashable] = []
+            self._responses: List[Any] = []
+            self._sources: List[frozenset] = []
+            self._thresholds = np.full(self.capacity, self.tau, dtype=np.float32)
+            self._recall = np.ones(self.capacity, dtype=np.float32)
+            self._last_used = np.zeros(self.capacity, dtype=np.int64)
+            self._size = 0
+            self._clock = 0
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _nearest(self, vector: np.ndarray, key: Hashable) -> Tuple[int, float]:
+        """Slot and similarity of the closest entry cached with the same ``key``."""
+        sims = self._embeddings[:self._size] @ vector
+        same_params = np.fromiter(
+            (cached_key == key for cached_key in self._keys), dtype=bool, count=self._size
+        )
+        sims[~same_params] = -np.inf
+        best = int(np.argmax(sims))
+        return best, float(sims[best])
+    
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+    
+    def lookup(self, embedding: List[float], key: Hashable) -> Optional[Any]:
+        """Return the cached response closest to ``embedding``, if close enough."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if not self._size:
+                return None
+            
+            best, sim = self._nearest(vector, key)
+            if sim < self._thresholds[best]:
+                return None
+            
+            self._clock += 1
+            self._last_used[best] = self._clock
+            return self._responses[best]
+    
+    def _adapt(self, slot: int, sim: float, sources: frozenset):
+        """Update a region's recall and threshold from a miss that landed near it."""
+        if not sources:
+            return
+        recall = len(sources & self._sources[slot]) / len(sources)
+        self._recall[slot] += self.alpha * (recall - self._recall[slot])
+        # A region may answer questions down to this similarity only if this
+        # one retrieved exactly the same sources; otherwise it backs off
+        # towards exact matches
+        well_served = sources == self._sources[slot] and self._recall[slot] >= self.recall_target
+        target = sim if well_served else 1.0
+        threshold = self._thresholds[slot] + self.alpha * (target - self._thresholds[slot])
+        self._thresholds[slot] = min(max(threshold, self.min_tau), 1.0)
+    
+    def insert(self, embedding: List[float], key: Hashable, response: Any):
+        """Cache a response, evicting the least recently used entry when full."""
+        if not self.enabled:
+            return
+        vector = self._normalize(embedding)
+        sources = _source_ids(response)
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.empty((self.capacity, vector.shape[0]), dtype=np.float32)
+            
+            if self._size:
+                nearest, sim = self._nearest(vector, key)
+                if sim >= self.min_tau:
+                    self._adapt(nearest, sim, sources)
+            
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+                self._keys.append(key)
+                self._responses.append(response)
+                self._sources.append(sources)
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._keys[slot] = key
+                self._responses[slot] = response
+                self._sources[slot] = sources
+            
+            self._embeddings[slot] = vector
+            self._thresholds[slot] = self.tau
+            self._recall[slot] = 1.0
+            self._clock += 1
+            self._last_used[slot] = self._clock
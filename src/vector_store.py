@@ -1,190 +1,980 @@
 """Vector store integration with Pinecone."""
 
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional, Dict, Any
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+from itertools import islice
+from typing import (
+    List, Optional, Dict, Any, Callable, Deque, Hashable, Iterable, Iterator, Tuple
+)
+import httpx
+import numpy as np
 from pinecone import Pinecone, ServerlessSpec
 from llama_index.vector_stores.pinecone import PineconeVectorStore
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.core.vector_stores.types import VectorStoreQuery, MetadataFilter, MetadataFilters, FilterOperator, FilterCondition
+from llama_index.core import VectorStoreIndex
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery, MetadataFilter, MetadataFilters, FilterOperator, FilterCondition
+)
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
-from llama_index.core import Settings
+from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+from semantic_cache import SemanticCache
+
+try:
+    from pinecone import PineconeAsyncio
+except ImportError:
+    PineconeAsyncio = None
 
 logger = logging.getLogger(__name__)
 
+# Index hosts keyed by (API key hash, index name); a host never changes for the
+# lifetime of an index, so describe_index only needs to run once per process
+_HOST_CACHE: Dict[Tuple[str, str], str] = {}
+
+# How long a fetched list of index names is trusted on SDKs without has_index
+INDEX_NAMES_TTL = 60.0
+
+# Largest document the list + fetch path serves; bigger ones go through a
+# regular ANN query, which beats many list and fetch round trips
+FETCH_MAX_IDS = 200
+
+# Parent chunk texts are stored once each, as records in this namespace keyed
+# by parent id, instead of being repeated in every child's metadata
+PARENT_NAMESPACE = "__parents__"
+
+# How long get_index_stats serves a previous describe_index_stats result
+INDEX_STATS_TTL = 5.0
+
+
+@dataclass(frozen=True)
+class VectorStoreOptions:
+    """Tuning knobs for VectorStoreManager."""
+    
+    # Size 3-series embeddings are shortened to; older models always use 1536
+    embedding_dim: int = 1024
+    # Upsert concurrency; keep it modest to stay under Pinecone rate limits
+    pool_threads: int = 30
+    # Number of texts sent per embeddings request
+    embeddings_chunk_size: int = 64
+    # Semantic cache size (0 disables it) and initial similarity threshold
+    semantic_cache_capacity: int = 256
+    semantic_cache_tau: float = 0.95
+    # Metadata fields whose value prefixes the vector ids (see _vector_id);
+    # an equality filter on one of them is served by list + fetch
+    pk_fields: Tuple[str, ...] = ("doc_id", "ref_doc_id", "document_id")
+    # Store int8-scaled vectors; only valid on a cosine index
+    quantize_vectors: bool = False
+    # Metadata fields that partition vectors into Pinecone namespaces. A
+    # vector goes to the namespace named by the first of these it carries,
+    # and an equality filter on one of them searches only that namespace.
+    namespace_keys: Tuple[str, ...] = ()
+
+
+def _wrap_errors(message: str, default: Any = False) -> Callable:
+    """Log any exception as ``"<message>: <error>"`` and return ``default`` instead.
+    
+    A callable ``default`` (e.g. ``dict``) is called so each failure gets a
+    fresh value.
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"{message}: {e}")
+                return default() if callable(default) else default
+        return wrapper
+    return decorator
+
+
+def _chunks(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yield successive lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _matches_to_dicts(result: Any) -> List[Dict[str, Any]]:
+    """Flatten a Pinecone query response into plain match dicts."""
+    return [
+        {"id": match.id, "score": match.score, "metadata": match.metadata}
+        for match in result.matches
+    ]
+
+
+def _has_operators(filters: Any) -> bool:
+    """Whether a filter dict uses Pinecone operators ($in, $gte, $or, ...)."""
+    if isinstance(filters, dict):
+        return any(
+            str(key).startswith("$") or _has_operators(value)
+            for key, value in filters.items()
+        )
+    if isinstance(filters, list):
+        return any(_has_operators(item) for item in filters)
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _build_filters(items: Tuple[Tuple[str, Hashable], ...]) -> MetadataFilters:
+    """Convert sorted (key, value) pairs into AND-ed equality MetadataFilters."""
+    return MetadataFilters(
+        # По умолчанию оператор EQ (равенство)
+        filters=[
+            MetadataFilter(key=key, value=value, operator=FilterOperator.EQ)
+            for key, value in items
+        ],
+        condition=FilterCondition.AND
+    )
+
+
+def _quantize_int8(embeddings: List[List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Scale each embedding onto the int8 grid [-127, 127].
+    
+    Returns the integer-valued vectors and the per-vector scale that maps them
+    back. Cosine similarity ignores the scale, so the quantized vectors can be
+    stored and queried as they are on a cosine index. Their short integer
+    values also make upsert and query payloads several times smaller.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    peaks = np.max(np.abs(matrix), axis=1, keepdims=True)
+    peaks[peaks == 0] = 1.0
+    quantized = np.round(matrix * 127 / peaks).astype(np.int8)
+    return quantized, (peaks[:, 0] / 127)
+
+
+class ParentContextPostprocessor(BaseNodePostprocessor):
+    """Swap retrieved child chunks for their parent chunk before synthesis.
+    
+    Parent texts come from the child's ``parent_text`` metadata when present,
+    otherwise from ``fetch_parents`` (parent ids -> texts).
+    """
+    
+    _fetch_parents: Optional[Callable[[List[str]], Dict[str, str]]] = PrivateAttr(default=None)
+    
+    def __init__(
+        self,
+        fetch_parents: Optional[Callable[[List[str]], Dict[str, str]]] = None,
+        **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self._fetch_parents = fetch_parents
+    
+    def _parent_texts(self, nodes: List[NodeWithScore]) -> Dict[str, str]:
+        """Look up the texts of parents the children don't carry themselves."""
+        missing = list(dict.fromkeys(
+            item.node.metadata["parent_id"] for item in nodes
+            if item.node.metadata.get("parent_id")
+            and item.node.metadata.get("parent_text") is None
+        ))
+        if not missing or self._fetch_parents is None:
+            return {}
+        try:
+            return self._fetch_parents(missing)
+        except Exception as e:
+            # Answer from the child chunks rather than failing the query
+            logger.warning(f"Failed to fetch parent chunks: {e}")
+            return {}
+    
+    @classmethod
+    def class_name(cls) -> str:
+        return "ParentContextPostprocessor"
+    
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        fetched = self._parent_texts(nodes)
+        result = []
+        positions = {}
+        for item in nodes:
+            metadata = item.node.metadata
+            parent_id = metadata.get("parent_id")
+            parent_text = metadata.get("parent_text", fetched.get(parent_id))
+            if not parent_id or parent_text is None:
+                result.append(item)
+                continue
+            
+            # Several children of one parent collapse into a single entry
+            # carrying the best child score
+            if parent_id in positions:
+                existing = result[positions[parent_id]]
+                if (item.score or 0.0) > (existing.score or 0.0):
+                    existing.score = item.score
+                continue
+            
+            parent = TextNode(
+                id_=parent_id,
+                text=parent_text,
+                metadata={
+                    key: value for key, value in metadata.items()
+                    if key not in ("parent_id", "parent_text")
+                }
+            )
+            positions[parent_id] = len(result)
+            result.append(NodeWithScore(node=parent, score=item.score))
+        return result
+
+
+class _CachedQueryEngine:
+    """Query engine wrapper that answers near-duplicate questions from a semantic cache."""
+    
+    def __init__(
+        self,
+        engine: Any,
+        embed_model: Any,
+        cache: SemanticCache,
+        cache_key: Hashable,
+        quantize: bool = False
+    ):
+        self._engine = engine
+        self._embed_model = embed_model
+        self._cache = cache
+        self._cache_key = cache_key
+        self._quantize = quantize
+    
+    def query(self, query_str: str) -> Any:
+        embedding = self._embed_model.get_query_embedding(query_str)
+        cached = self._cache.lookup(embedding, self._cache_key)
+        if cached is not None:
+            return cached
+        
+        # Hand the embedding to the retriever so the question isn't embedded twice;
+        # the cache keeps the full-precision vector
+        query_embedding = embedding
+        if self._quantize:
+            query_embedding = _quantize_int8(embedding)[0][0].astype(np.float32).tolist()
+        response = self._engine.query(QueryBundle(query_str=query_str, embedding=query_embedding))
+        self._cache.insert(embedding, self._cache_key, response)
+        return response
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._engine, name)
+
+
+class _FetchRetriever(BaseRetriever):
+    """Retrieve one document's chunks by id prefix and rank them locally.
+    
+    When a filter already pins the search to a single document, listing and
+    fetching its few vectors is cheaper than an ANN query over the index.
+    """
+    
+    def __init__(
+        self,
+        pinecone_index: Any,
+        embed_model: Any,
+        id_prefix: str,
+        similarity_top_k: int,
+        fallback: BaseRetriever,
+        namespace: str = ""
+    ):
+        super().__init__()
+        self._pinecone_index = pinecone_index
+        self._embed_model = embed_model
+        self._id_prefix = id_prefix
+        self._similarity_top_k = similarity_top_k
+        self._fallback = fallback
+        self._namespace = namespace
+    
+    def _list_ids(self) -> Optional[List[str]]:
+        """Ids under the prefix, or None once there are more than FETCH_MAX_IDS."""
+        ids: List[str] = []
+        pagination_token = None
+        while True:
+            page = self._pinecone_index.list_paginated(
+                prefix=self._id_prefix,
+                namespace=self._namespace,
+                limit=100,
+                pagination_token=pagination_token
+            )
+            ids.extend(item.id for item in page.vectors)
+            if len(ids) > FETCH_MAX_IDS:
+                return None
+            pagination_token = page.pagination.next if page.pagination else None
+            if not pagination_token:
+                return ids
+    
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        ids = self._list_ids()
+        if not ids:
+            # Large documents, and vectors written before ids were prefixed,
+            # are served by a regular query
+            return self._fallback.retrieve(query_bundle)
+        
+        vectors = []
+        for batch in _chunks(ids, 100):
+            vectors.extend(
+                self._pinecone_index.fetch(ids=batch, namespace=self._namespace).vectors.values()
+            )
+        
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        query = np.asarray(embedding, dtype=np.float32)
+        matrix = np.asarray([vector.values for vector in vectors], dtype=np.float32)
+        # Cosine similarity, to match the scores Pinecone reports
+        sims = (matrix @ query) / (
+            np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12
+        )
+        top = np.argsort(sims)[::-1][:self._similarity_top_k]
+        return [
+            NodeWithScore(node=metadata_dict_to_node(vectors[i].metadata), score=float(sims[i]))
+            for i in top
+        ]
+
 
 class VectorStoreManager:
     """Manage Pinecone vector store operations."""
     
-    def __init__(self, api_key: str, environment: str, index_name: str):
+    def __init__(
+        self,
+        api_key: str,
+        environment: str,
+        index_name: str,
+        embedding_model: str = "text-embedding-3-small",
+        llm_model: str = "gpt-4o-mini",
+        options: Optional[VectorStoreOptions] = None
+    ):
+        options = options or VectorStoreOptions()
         self.api_key = api_key
         self.environment = environment
         self.index_name = index_name
+        self.options = options
+        self.pool_threads = options.pool_threads
+        self.embeddings_chunk_size = options.embeddings_chunk_size
+        self.pk_fields = frozenset(options.pk_fields)
+        self.quantize_vectors = options.quantize_vectors
+        self.namespace_keys = tuple(options.namespace_keys)
         self.pc = None
         self.pinecone_index = None
+        self._index_host = None
+        self._index_names_cache: Optional[Tuple[float, set]] = None
+        self._stats_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._async_pc = None
+        self._async_index = None
         self.vector_store = None
         self.index = None
+        self._namespace_indexes: Dict[str, VectorStoreIndex] = {}
+        # Bumped whenever the index contents change; answer caches outside
+        # the manager key on it to drop stale answers
+        self.index_generation = 0
+        self._semantic_cache = SemanticCache(
+            capacity=options.semantic_cache_capacity,
+            tau=options.semantic_cache_tau
+        )
         
-        # Initialize OpenAI models
-        self.embed_model = OpenAIEmbedding(model="text-embedding-ada-002")
-        self.llm = OpenAI(model="gpt-4", temperature=0.2)
+        # One long-lived HTTP/2 client for all OpenAI traffic, so embedding and
+        # completion calls reuse warm connections instead of new TLS handshakes
+        self._http = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            timeout=30
+        )
         
-        # Set global settings
-        Settings.embed_model = self.embed_model
-        Settings.llm = self.llm
+        # Initialize OpenAI models. Only the 3-series embeddings can be shortened;
+        # older models always return 1536 dimensions.
+        shortenable = embedding_model.startswith("text-embedding-3")
+        self.embedding_dim = options.embedding_dim if shortenable else 1536
+        self.embed_model = OpenAIEmbedding(
+            model=embedding_model,
+            dimensions=options.embedding_dim if shortenable else None,
+            http_client=self._http
+        )
+        # Passed explicitly wherever LlamaIndex needs them instead of being set
+        # on the global Settings, so managers with different models don't clash
+        self.llm = OpenAI(model=llm_model, temperature=0.2, http_client=self._http)
+    
+    @staticmethod
+    def _vector_id(node: BaseNode) -> str:
+        """Pinecone id for a node, prefixed with its document id when it has one."""
+        if node.ref_doc_id:
+            return f"{node.ref_doc_id}#{node.node_id}"
+        return node.node_id
     
+    def _host_cache_key(self) -> Tuple[str, str]:
+        """Key for the module-level host cache, without keeping the raw API key."""
+        return hashlib.sha256(self.api_key.encode()).hexdigest(), self.index_name
+    
+    @_wrap_errors("Failed to initialize Pinecone")
     def initialize_pinecone(self) -> bool:
         """Initialize Pinecone connection."""
-        try:
+        self.pc = Pinecone(api_key=self.api_key)
+        return True
+    
+    def _ensure_pc(self):
+        """Create the Pinecone client on first use."""
+        if self.pc is None:
             self.pc = Pinecone(api_key=self.api_key)
-            return True
-        except Exception as e:
-            logger.error(f"Failed to initialize Pinecone: {e}")
-            return False
     
-    def create_index(self, dimension: int = 1536, metric: str = "cosine") -> bool:
-        """Create a new Pinecone index if it doesn't exist."""
-        try:
-            if not self.pc:
-                if not self.initialize_pinecone():
-                    return False
-            
-            existing_indexes = [index_info["name"] for index_info in self.pc.list_indexes()]
-            
-            if self.index_name not in existing_indexes:
-                self.pc.create_index(
-                    name=self.index_name,
-                    dimension=dimension,
-                    metric=metric,
-                    spec=ServerlessSpec(
-                        cloud="aws",
-                        region="us-east-1"
-                    )
+    def _ensure_index(self):
+        """Connect to the index on first use, raising if that isn't possible."""
+        if self.vector_store is None and not self.connect_to_index():
+            raise RuntimeError(f"Could not connect to index {self.index_name}")
+    
+    @_wrap_errors("Failed to create index")
+    def create_index(self, dimension: Optional[int] = None, metric: str = "cosine") -> bool:
+        """Create a new Pinecone index if it doesn't exist.
+        
+        ``dimension`` defaults to the embedding size configured on the manager.
+        """
+        self._ensure_pc()
+        
+        if not self._index_exists():
+            self.pc.create_index(
+                name=self.index_name,
+                dimension=dimension or self.embedding_dim,
+                metric=metric,
+                spec=ServerlessSpec(
+                    cloud="aws",
+                    region="us-east-1"
                 )
-                logger.info(f"Created new index: {self.index_name}")
-            else:
-                logger.info(f"Index {self.index_name} already exists")
-            
-            return True
-        except Exception as e:
-            logger.error(f"Failed to create index: {e}")
-            return False
+            )
+            if self._index_names_cache is not None:
+                self._index_names_cache[1].add(self.index_name)
+            logger.info(f"Created new index: {self.index_name}")
+        else:
+            logger.info(f"Index {self.index_name} already exists")
+        
+        return True
     
+    def _index_exists(self) -> bool:
+        """Check whether the index exists without scanning every index when possible."""
+        if hasattr(self.pc, "has_index"):
+            return self.pc.has_index(self.index_name)
+        
+        # Older SDKs: fall back to listing, but reuse the result for a short while
+        now = time.monotonic()
+        if self._index_names_cache is None or now - self._index_names_cache[0] >= INDEX_NAMES_TTL:
+            names = {index_info["name"] for index_info in self.pc.list_indexes()}
+            self._index_names_cache = (now, names)
+        return self.index_name in self._index_names_cache[1]
+    
+    @_wrap_errors("Failed to connect to index")
     def connect_to_index(self) -> bool:
         """Connect to existing Pinecone index."""
-        try:
-            if not self.pc:
-                if not self.initialize_pinecone():
-                    return False
-            
-            # Get index host
+        self._ensure_pc()
+        
+        # Get index host, skipping the control-plane call when it's cached
+        cache_key = self._host_cache_key()
+        index_host = _HOST_CACHE.get(cache_key)
+        if index_host is None:
             index_description = self.pc.describe_index(self.index_name)
             index_host = index_description.host
-            
-            # Connect to index
-            self.pinecone_index = self.pc.Index(host=index_host)
-            
-            # Create vector store
-            self.vector_store = PineconeVectorStore(pinecone_index=self.pinecone_index)
-            
-            logger.info(f"Connected to index: {self.index_name}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to connect to index: {e}")
-            return False
+            _HOST_CACHE[cache_key] = index_host
+        self._index_host = index_host
+        
+        # Connect to index
+        self.pinecone_index = self.pc.Index(host=index_host, pool_threads=self.pool_threads)
+        
+        # Create vector store
+        self.vector_store = PineconeVectorStore(pinecone_index=self.pinecone_index)
+        self._namespace_indexes = {}
+        self._stats_cache = None
+        
+        logger.info(f"Connected to index: {self.index_name}")
+        return True
     
-    def create_vector_index(self, documents: List[Any]) -> bool:
-        """Create VectorStoreIndex from documents."""
-        try:
-            if not self.vector_store:
-                if not self.connect_to_index():
-                    return False
-            
-            storage_context = StorageContext.from_defaults(
-                vector_store=self.vector_store
+    @_wrap_errors("Failed to create vector index")
+    def create_vector_index(self, nodes: List[Any]) -> bool:
+        """Create VectorStoreIndex from pre-chunked nodes."""
+        self._ensure_index()
+        
+        # Vectors are produced lazily, so embedding requests overlap with the
+        # upserts already in flight
+        parent_texts: Dict[str, str] = {}
+        self._parallel_upsert(self._embed_nodes(nodes, parent_texts))
+        self._parallel_upsert(self._parent_records(parent_texts), namespace=PARENT_NAMESPACE)
+        self._contents_changed()
+        
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store=self.vector_store,
+            embed_model=self.embed_model
+        )
+        
+        logger.info(f"Created vector index with {len(nodes)} nodes")
+        return True
+    
+    def _contents_changed(self):
+        """Invalidate everything derived from the index contents."""
+        self._semantic_cache.clear()
+        self._stats_cache = None
+        self.index_generation += 1
+    
+    def _embed_nodes(
+        self,
+        nodes: List[Any],
+        parent_texts: Dict[str, str]
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield upsert-ready vectors, embedding the nodes in multi-text requests.
+        
+        ``parent_text`` is moved out of each child's metadata into
+        ``parent_texts`` so the parent is stored once, not once per child.
+        """
+        for batch in _chunks(nodes, self.embeddings_chunk_size):
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
             )
+            if self.quantize_vectors:
+                embeddings = _quantize_int8(embeddings)[0].astype(np.float32).tolist()
             
-            self.index = VectorStoreIndex.from_documents(
-                documents,
-                storage_context=storage_context
-            )
+            for node, embedding in zip(batch, embeddings):
+                if node.metadata.get("parent_text") is not None:
+                    parent_texts[node.metadata["parent_id"]] = node.metadata["parent_text"]
+                    node = node.model_copy(update={"metadata": {
+                        key: value for key, value in node.metadata.items()
+                        if key != "parent_text"
+                    }})
+                yield {
+                    "id": self._vector_id(node),
+                    "values": embedding,
+                    "metadata": node_to_metadata_dict(node, remove_text=False, flat_metadata=True)
+                }
+    
+    def _parent_records(self, parent_texts: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+        """Yield one record per parent chunk, fetched by id and never queried."""
+        # Pinecone requires a non-zero vector; these records live in their own
+        # namespace and are only ever read with fetch
+        placeholder = [1.0] + [0.0] * (self.embedding_dim - 1)
+        for parent_id, text in parent_texts.items():
+            yield {"id": parent_id, "values": placeholder, "metadata": {"text": text}}
+    
+    def _fetch_parent_texts(self, parent_ids: List[str]) -> Dict[str, str]:
+        """Texts of the given parent chunks, read from PARENT_NAMESPACE."""
+        texts = {}
+        for batch in _chunks(parent_ids, 100):
+            response = self.pinecone_index.fetch(ids=batch, namespace=PARENT_NAMESPACE)
+            for vector_id, vector in response.vectors.items():
+                texts[vector_id] = (vector.metadata or {}).get("text", "")
+        return texts
+    
+    def _namespace_for(self, metadata: Dict[str, Any]) -> str:
+        """Namespace a vector with this metadata is stored in ("" is the default)."""
+        for key in self.namespace_keys:
+            value = metadata.get(key)
+            if isinstance(value, str) and value:
+                return value
+        return ""
+    
+    def _split_namespace(self, filters: Optional[Dict]) -> Tuple[str, Optional[Dict]]:
+        """Pull a namespace key out of ``filters``, returning it and the remaining filters."""
+        if not filters:
+            return "", filters
+        for key in self.namespace_keys:
+            value = filters.get(key)
+            if isinstance(value, str) and value:
+                remaining = {k: v for k, v in filters.items() if k != key}
+                return value, remaining or None
+        return "", filters
+    
+    def _parallel_upsert(
+        self,
+        vectors: Iterable[Dict[str, Any]],
+        batch_size: int = 100,
+        namespace: Optional[str] = None
+    ):
+        """Upsert vectors with up to ``pool_threads`` batches in flight.
+        
+        ``vectors`` may be a lazy iterable: it is consumed while earlier batches
+        are still being written, and only unsent and in-flight batches are held
+        in memory. Each vector goes to ``namespace`` if given, otherwise to the
+        one ``_namespace_for`` picks from its metadata.
+        """
+        fixed_namespace = namespace
+        pending: Dict[str, List[Dict[str, Any]]] = {}
+        in_flight: Deque[Future] = deque()
+        with ThreadPoolExecutor(max_workers=self.pool_threads) as executor:
+            def submit(namespace: str, batch: List[Dict[str, Any]]):
+                if len(in_flight) >= self.pool_threads:
+                    in_flight.popleft().result()
+                in_flight.append(
+                    executor.submit(self.pinecone_index.upsert, vectors=batch, namespace=namespace)
+                )
             
-            logger.info(f"Created vector index with {len(documents)} documents")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to create vector index: {e}")
-            return False
+            for vector in vectors:
+                namespace = fixed_namespace
+                if namespace is None:
+                    namespace = self._namespace_for(vector["metadata"])
+                group = pending.setdefault(namespace, [])
+                group.append(vector)
+                if len(group) >= batch_size:
+                    submit(namespace, pending.pop(namespace))
+            for namespace, group in pending.items():
+                submit(namespace, group)
+            # Wait for every batch so failures surface to the caller
+            for future in in_flight:
+                future.result()
+    
+    @_wrap_errors("Failed to delete vectors")
+    def delete_vectors(
+        self,
+        ids: Iterable[str],
+        namespace: Optional[str] = None,
+        batch_size: int = 1000
+    ) -> bool:
+        """Delete vectors by id without dropping the index.
+        
+        Ids are sent in batches of ``batch_size`` issued concurrently from a
+        thread pool, like upserts. Parent chunk records in PARENT_NAMESPACE
+        are only removed when their ids are passed with that namespace.
+        """
+        self._ensure_index()
+        
+        batches = list(_chunks(ids, batch_size))
+        
+        def delete(batch: List[str]):
+            self.pinecone_index.delete(ids=batch, namespace=namespace or "")
+        
+        if batches:
+            # Consuming the results re-raises the first failed batch in the caller
+            with ThreadPoolExecutor(max_workers=min(self.pool_threads, len(batches))) as executor:
+                list(executor.map(delete, batches))
+        self._contents_changed()
+        
+        logger.info(f"Deleted {sum(len(batch) for batch in batches)} vectors")
+        return True
     
+    @_wrap_errors("Failed to load existing index")
     def load_existing_index(self) -> bool:
         """Load existing VectorStoreIndex."""
-        try:
-            if not self.vector_store:
-                if not self.connect_to_index():
-                    return False
-            
-            storage_context = StorageContext.from_defaults(
-                vector_store=self.vector_store
-            )
-            
-            self.index = VectorStoreIndex(
-                nodes=[],
-                storage_context=storage_context
+        self._ensure_index()
+        
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store=self.vector_store,
+            embed_model=self.embed_model
+        )
+        
+        logger.info("Loaded existing vector index")
+        return True
+    
+    def _index_for_namespace(self, namespace: str) -> VectorStoreIndex:
+        """VectorStoreIndex scoped to one namespace, built once per namespace."""
+        if not namespace:
+            return self.index
+        index = self._namespace_indexes.get(namespace)
+        if index is None:
+            index = VectorStoreIndex.from_vector_store(
+                vector_store=PineconeVectorStore(
+                    pinecone_index=self.pinecone_index,
+                    namespace=namespace
+                ),
+                embed_model=self.embed_model
             )
-            
-            logger.info("Loaded existing vector index")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to load existing index: {e}")
-            return False
+            self._namespace_indexes[namespace] = index
+        return index
     
-    def get_query_engine(self, similarity_top_k: int = 5, filters: Optional[Dict] = None):
-        """Get query engine for searching."""
+    def get_query_engine(
+        self,
+        similarity_top_k: int = 5,
+        filters: Optional[Dict] = None,
+        similarity_cutoff: Optional[float] = None
+    ):
+        """Get query engine for searching.
+        
+        Nodes scoring below ``similarity_cutoff`` are dropped before they reach
+        the LLM. A filter on one of ``namespace_keys`` selects the namespace to
+        search instead of being applied as a metadata filter. Filters written
+        in Pinecone's operator syntax (``{"year": {"$gte": 2020}}``,
+        ``{"$or": [...]}``) are passed to Pinecone unchanged.
+        """
         if not self.index:
             return None
         
+        cache_filters = filters
+        namespace, filters = self._split_namespace(filters)
+        index = self._index_for_namespace(namespace)
+        
+        native_filters = filters if _has_operators(filters) else None
+        
         # Преобразование filters (dict) в MetadataFilters, если нужно
         metadata_filters = None
-        if filters and isinstance(filters, dict) and len(filters) > 0:
-            filter_list = []
-            for key, value in filters.items():
-                # По умолчанию оператор EQ (равенство)
-                filter_list.append(MetadataFilter(key=key, value=value, operator=FilterOperator.EQ))
-            metadata_filters = MetadataFilters(
-                filters=filter_list,
-                condition=FilterCondition.AND
+        if native_filters is None and filters and isinstance(filters, dict) and len(filters) > 0:
+            items = tuple(sorted(filters.items()))
+            try:
+                metadata_filters = _build_filters(items)
+            except TypeError:
+                # Unhashable values (e.g. lists) can't be memoized
+                metadata_filters = _build_filters.__wrapped__(items)
+        
+        node_postprocessors = [ParentContextPostprocessor(fetch_parents=self._fetch_parent_texts)]
+        if similarity_cutoff is not None:
+            node_postprocessors.insert(
+                0, SimilarityPostprocessor(similarity_cutoff=similarity_cutoff)
+            )
+        
+        pk_value = None
+        if native_filters is None and filters and len(filters) == 1:
+            (key, value), = filters.items()
+            if key in self.pk_fields and isinstance(value, str):
+                pk_value = value
+        
+        if pk_value is not None:
+            retriever = _FetchRetriever(
+                pinecone_index=self.pinecone_index,
+                embed_model=self.embed_model,
+                id_prefix=f"{pk_value}#",
+                similarity_top_k=similarity_top_k,
+                fallback=index.as_retriever(
+                    similarity_top_k=similarity_top_k,
+                    filters=metadata_filters
+                ),
+                namespace=namespace
+            )
+            query_engine = RetrieverQueryEngine.from_args(
+                retriever,
+                llm=self.llm,
+                node_postprocessors=node_postprocessors
+            )
+        else:
+            query_engine = index.as_query_engine(
+                similarity_top_k=similarity_top_k,
+                filters=metadata_filters,
+                vector_store_kwargs=(
+                    {"pinecone_query_filters": native_filters} if native_filters else {}
+                ),
+                llm=self.llm,
+                node_postprocessors=node_postprocessors
             )
+        if not self._semantic_cache.enabled:
+            return query_engine
         
-        return self.index.as_query_engine(
-            similarity_top_k=similarity_top_k,
-            filters=metadata_filters
+        # Cached responses are only reused for the same search parameters
+        cache_key = (
+            similarity_top_k,
+            similarity_cutoff,
+            repr(sorted((cache_filters or {}).items()))
+        )
+        return _CachedQueryEngine(
+            query_engine,
+            self.embed_model,
+            self._semantic_cache,
+            cache_key,
+            quantize=self.quantize_vectors
         )
     
-    def get_index_stats(self) -> Dict[str, Any]:
-        """Get index statistics."""
+    @staticmethod
+    def _pinecone_filter(filters: Optional[Dict]) -> Optional[Dict[str, Any]]:
+        """Translate a flat {key: value} dict into Pinecone's native filter syntax.
+        
+        Filters that already use Pinecone operators are returned unchanged.
+        """
+        if not filters:
+            return None
+        if _has_operators(filters):
+            return filters
+        return {key: {"$eq": value} for key, value in filters.items()}
+    
+    @_wrap_errors("Failed to run batch query", default=list)
+    def batch_query(
+        self,
+        questions: List[str],
+        top_k: int = 5,
+        filters: Optional[Dict] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Retrieve matches for several questions at once.
+        
+        All questions are embedded in one request and the Pinecone queries are
+        fanned out over a thread pool. Returns one list of matches per question.
+        """
+        if not self.pinecone_index or not questions:
+            return []
+        
+        embeddings = self.embed_model.get_text_embedding_batch(questions)
+        if self.quantize_vectors:
+            embeddings = _quantize_int8(embeddings)[0].astype(np.float32).tolist()
+        
+        namespace, filters = self._split_namespace(filters)
+        pinecone_filter = self._pinecone_filter(filters)
+        
+        def run_query(embedding: List[float]) -> List[Dict[str, Any]]:
+            return _matches_to_dicts(self.pinecone_index.query(
+                vector=embedding,
+                top_k=top_k,
+                filter=pinecone_filter,
+                namespace=namespace,
+                include_metadata=True
+            ))
+        
+        with ThreadPoolExecutor(max_workers=min(self.pool_threads, len(questions))) as executor:
+            return list(executor.map(run_query, embeddings))
+    
+    @_wrap_errors("Failed to run filtered query", default=list)
+    def query_with_filter(
+        self,
+        question: str,
+        pinecone_filter: Dict[str, Any],
+        top_k: int = 5
+    ) -> List[Dict[str, Any]]:
+        """Retrieve matches for a question using a raw Pinecone filter.
+        
+        ``pinecone_filter`` is sent as is, so any operator Pinecone supports
+        ($in, $nin, $gte, $lt, $and, $or, ...) can be used.
+        """
         if not self.pinecone_index:
-            return {}
+            return []
+        
+        embedding = self.embed_model.get_query_embedding(question)
+        if self.quantize_vectors:
+            embedding = _quantize_int8(embedding)[0][0].astype(np.float32).tolist()
+        
+        return _matches_to_dicts(self.pinecone_index.query(
+            vector=embedding,
+            filter=pinecone_filter,
+            top_k=top_k,
+            include_metadata=True
+        ))
+    
+    def _get_async_index(self) -> Any:
+        """Lazily open one asyncio Pinecone client and index handle for reuse."""
+        if self._async_index is None:
+            self._async_pc = PineconeAsyncio(api_key=self.api_key)
+            self._async_index = self._async_pc.IndexAsyncio(host=self._index_host)
+        return self._async_index
+    
+    async def aquery(
+        self,
+        question: str,
+        top_k: int = 5,
+        filters: Optional[Dict] = None
+    ) -> List[Dict[str, Any]]:
+        """Retrieve matches for a question without blocking the event loop.
+        
+        Uses the embedding model's async OpenAI client and Pinecone's asyncio
+        client; on SDKs without the latter the sync query runs in a thread.
+        """
+        if not self.pinecone_index:
+            return []
         
         try:
-            stats = self.pinecone_index.describe_index_stats()
-            return {
-                "total_vectors": stats.total_vector_count,
-                "dimension": stats.dimension,
-                "index_fullness": stats.index_fullness
+            embedding = await self.embed_model.aget_query_embedding(question)
+            if self.quantize_vectors:
+                embedding = _quantize_int8(embedding)[0][0].astype(np.float32).tolist()
+            
+            namespace, filters = self._split_namespace(filters)
+            query_kwargs = {
+                "vector": embedding,
+                "top_k": top_k,
+                "filter": self._pinecone_filter(filters),
+                "namespace": namespace,
+                "include_metadata": True
             }
+            if PineconeAsyncio is None:
+                result = await asyncio.to_thread(self.pinecone_index.query, **query_kwargs)
+            else:
+                result = await self._get_async_index().query(**query_kwargs)
+            return _matches_to_dicts(result)
         except Exception as e:
-            logger.error(f"Failed to get index stats: {e}")
+            logger.error(f"Failed to run async query: {e}")
+            return []
+    
+    def close(self):
+        """Close the shared HTTP client used for OpenAI requests."""
+        self._http.close()
+    
+    async def aclose(self):
+        """Close the asyncio Pinecone client opened by aquery."""
+        if self._async_index is not None:
+            await self._async_index.close()
+            self._async_index = None
+        if self._async_pc is not None:
+            await self._async_pc.close()
+            self._async_pc = None
+    
+    @_wrap_errors("Failed to get index stats", default=dict)
+    def get_index_stats(self) -> Dict[str, Any]:
+        """Get index statistics, reusing a result fetched within INDEX_STATS_TTL."""
+        if not self.pinecone_index:
             return {}
+        
+        now = time.monotonic()
+        if self._stats_cache is not None and now - self._stats_cache[0] < INDEX_STATS_TTL:
+            return dict(self._stats_cache[1])
+        
+        stats = self.pinecone_index.describe_index_stats()
+        # Parent text records aren't searchable vectors
+        parents = (getattr(stats, "namespaces", None) or {}).get(PARENT_NAMESPACE)
+        value = {
+            "total_vectors": stats.total_vector_count - (parents.vector_count if parents else 0),
+            "dimension": stats.dimension,
+            "index_fullness": stats.index_fullness
+        }
+        self._stats_cache = (now, value)
+        return dict(value)
     
+    @_wrap_errors("Failed to delete index")
     def delete_index(self) -> bool:
         """Delete the Pinecone index."""
-        try:
-            if not self.pc:
-                if not self.initialize_pinecone():
-                    return False
-            
-            self.pc.delete_index(self.index_name)
-            logger.info(f"Deleted index: {self.index_name}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to delete index: {e}")
-            return False
\ No newline at end of file
+        self._ensure_pc()
+        
+        self.pc.delete_index(self.index_name)
+        _HOST_CACHE.pop(self._host_cache_key(), None)
+        self._contents_changed()
+        if self._index_names_cache is not None:
+            self._index_names_cache[1].discard(self.index_name)
+        logger.info(f"Deleted index: {self.index_name}")
+        return True
+    
+    # Async counterparts of the blocking public methods. Each runs its sync
+    # twin in a worker thread so callers on an event loop stay responsive.
+    
+    async def ainitialize_pinecone(self) -> bool:
+        return await asyncio.to_thread(self.initialize_pinecone)
+    
+    async def acreate_index(self, dimension: Optional[int] = None, metric: str = "cosine") -> bool:
+        return await asyncio.to_thread(self.create_index, dimension, metric)
+    
+    async def aconnect_to_index(self) -> bool:
+        return await asyncio.to_thread(self.connect_to_index)
+    
+    async def acreate_vector_index(self, nodes: List[Any]) -> bool:
+        return await asyncio.to_thread(self.create_vector_index, nodes)
+    
+    async def adelete_vectors(
+        self,
+        ids: Iterable[str],
+        namespace: Optional[str] = None,
+        batch_size: int = 1000
+    ) -> bool:
+        return await asyncio.to_thread(self.delete_vectors, ids, namespace, batch_size)
+    
+    async def aload_existing_index(self) -> bool:
+        return await asyncio.to_thread(self.load_existing_index)
+    
+    async def abatch_query(
+        self,
+        questions: List[str],
+        top_k: int = 5,
+        filters: Optional[Dict] = None
+    ) -> List[List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self.batch_query, questions, top_k, filters)
+    
+    async def aquery_with_filter(
+        self,
+        question: str,
+        pinecone_filter: Dict[str, Any],
+        top_k: int = 5
+    ) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.query_with_filter, question, pinecone_filter, top_k)
+    
+    async def aget_index_stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_index_stats)
+    
+    async def adelete_index(self) -> bool:
+        return await asyncio.to_thread(self.delete_index)
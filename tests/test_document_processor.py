@@ -0,0 +1,51 @@
+"""Tests for document chunking."""
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("llama_index.core")
+
+from llama_index.core import Document
+from llama_index.core.schema import NodeRelationship
+
+from document_processor import DocumentProcessor
+
+
+SENTENCE = "Retrieval augmented generation pairs a search index with a language model. "
+
+
+@pytest.mark.parametrize("use_fast_chunker", [False, True])
+def test_chunk_documents_links_children_to_parents(use_fast_chunker):
+    if use_fast_chunker:
+        pytest.importorskip("chonkie")
+    processor = DocumentProcessor(use_fast_chunker=use_fast_chunker)
+    document = Document(text=SENTENCE * 400, metadata={"filename": "doc.pdf"})
+    
+    children = processor.chunk_documents([document])
+    
+    # Node ids are random, so parents are recovered from the children
+    # themselves rather than from a second split
+    by_parent = {}
+    for child in children:
+        by_parent.setdefault(child.metadata["parent_id"], []).append(child)
+    
+    assert len(children) > len(by_parent) > 1
+    for parent_id, siblings in by_parent.items():
+        parent_text = siblings[0].metadata["parent_text"]
+        for child in siblings:
+            assert child.metadata["parent_text"] == parent_text
+            assert child.text in parent_text
+            assert child.relationships[NodeRelationship.PARENT].node_id == parent_id
+            assert child.ref_doc_id == document.doc_id
+            assert "parent_text" in child.excluded_embed_metadata_keys
+            assert "parent_text" in child.excluded_llm_metadata_keys
+
+
+def test_chunk_documents_without_children_returns_parents():
+    processor = DocumentProcessor(use_fast_chunker=False, child_chunk_size=None)
+    document = Document(text=SENTENCE * 400)
+    
+    nodes = processor.chunk_documents([document])
+    
+    assert nodes
+    assert all("parent_id" not in node.metadata for node in nodes)